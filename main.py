@@ -1,16 +1,22 @@
 import os
+import sys
 import datetime
-import json
 import logging
-from typing import List, Optional, Dict, Any, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import List, Optional, Dict, Any, Tuple, FrozenSet
 
 # ▼▼▼ 変更点1: Flask をインポート ▼▼▼
 from flask import Flask, request
 
+import orjson
 import requests
 import google.auth
 import gspread
 from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
 from urllib3.util.retry import Retry
 
 # ▼▼▼ 変更点2: Flaskアプリケーションを初期化 (変数名は必ず 'app') ▼▼▼
@@ -31,42 +37,143 @@ JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
 EDINET_API_BASE_URL = "https://disclosure.edinet-fsa.go.jp/api/v2"
 EDINET_DOC_LIST_URL = f"{EDINET_API_BASE_URL}/documents.json"
 
-# リクエストのタイムアウト設定 (秒)
-REQUEST_TIMEOUT = 10.0
+# リクエストのタイムアウト設定 (秒): (接続, 読み取り)
+# Cloud Run のリクエスト時間を1つの呼び出しで使い切らないよう、短めに設定する
+CONNECT_TIMEOUT = 2.0
+READ_TIMEOUT = 5.0
+REQUEST_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Slackメッセージのテンプレート
+SLACK_TEMPLATE = "📢 *開示情報 ({})*\n*企業名*: {}\n*書類*: {}\n*PDF*: {}"
+SUMMARY_TEMPLATE = "✅ *開示なし ({} {})*\n監視対象({}社)について、新規の開示はありませんでした。"
+
+# APIレスポンスに項目が無い場合の既定値
+UNKNOWN_DOC = "不明な書類"
+UNKNOWN_FILER = "不明な企業"
+
+# 通知対象の書類から必要な項目をまとめて取り出す
+_EXTRACT = itemgetter("submitDateTime", "docDescription", "filerName", "docID")
+
+# 監視対象リストのキャッシュ有効期間 (秒)。シートの更新は1日数回程度のため
+CODES_CACHE_TTL = 600.0
+
+# Slack通知の並列送信数 (SESSIONのSlack用pool_maxsizeと同じ)
+SLACK_MAX_WORKERS = 8
+
+# Slack Incoming Webhook のURLプレフィックス (Webhook用のリトライ設定を適用する)
+SLACK_WEBHOOK_PREFIX = "https://hooks.slack.com/"
+
+# Retry-After ヘッダーに従って待機する上限 (秒)。これを超える指示を受けた場合は再試行せず失敗とする
+RETRY_AFTER_MAX = 3.0
+
+# 「開示なし」サマリー通知の有効/無効 (SUMMARY_ENABLED=0 で無効化)
+SUMMARY_ENABLED = os.environ.get("SUMMARY_ENABLED", "1") == "1"
 
 # ---------------------------------------------------------------------------
 # ヘルパー関数
 # ---------------------------------------------------------------------------
 
-def get_session_with_retries() -> requests.Session:
+class _FailFastRetry(Retry):
+    """
+    Retry-After ヘッダーの待機時間が RETRY_AFTER_MAX 秒を超える場合に、再試行せず即座に失敗させるリトライ設定。
+    レート制限中に早めに再送して、再度 429 を受けることを避ける。
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and response.status in self.RETRY_AFTER_STATUS_CODES:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > RETRY_AFTER_MAX:
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After {retry_after}s exceeds {RETRY_AFTER_MAX}s"))
+        return super().increment(
+            method=method, url=url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace
+        )
+
+def _build_session() -> requests.Session:
     """
     リトライロジックを含むHTTPセッションを作成する。
-    一時的なネットワークエラー（5xx系）に対する耐性を高める。
+    一時的なネットワークエラー（5xx系・429）に対する耐性を高める。
     """
     session = requests.Session()
-    # backoff_factor=1 により、1秒, 2秒, 4秒と待機時間が増加
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    # backoff_factor=0.2 によりステータスコードでの再試行間隔を短く抑える
+    # 429等の Retry-After は RETRY_AFTER_MAX 秒以内なら従い、それを超える場合は再試行せず失敗させる
+    # EDINET (GET) は冪等なため、切断・読み取りタイムアウトでも再試行する
+    # allowed_methods は既定値 (POSTを含まない) のため、この設定でPOSTが再送されることはない
+    retries = _FailFastRetry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True
+    )
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+
+    # Slack Webhook (POST) は冪等ではないため、未配信が確実な場合のみ再試行する
+    # read=0: 送信後の切断・読み取りタイムアウトでは再試行しない (配信済みの通知を再送しうるため)
+    # status_forcelist=[429]: 5xx は配信済みの可能性があるため再試行しない
+    slack_retries = _FailFastRetry(
+        total=3,
+        read=0,
+        backoff_factor=0.2,
+        status_forcelist=[429],
+        respect_retry_after_header=True,
+        allowed_methods=frozenset(['POST'])
+    )
+    session.mount(SLACK_WEBHOOK_PREFIX, HTTPAdapter(pool_connections=1, pool_maxsize=SLACK_MAX_WORKERS, max_retries=slack_retries))
     return session
 
-def get_target_codes_from_sheet(sheet_id: str) -> List[str]:
+# 共有HTTPセッション: インスタンス内でコネクションプールを再利用し、TLSハンドシェイクを削減
+SESSION = _build_session()
+
+# シート・EDINET取得用の共有スレッドプール: 1リクエストあたり2タスク。同時実行される数リクエスト分を確保する
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fetch")
+
+# Slack通知用の共有スレッドプール: リクエストごとのスレッド起動コストを避ける
+SLACK_EXECUTOR = ThreadPoolExecutor(max_workers=SLACK_MAX_WORKERS, thread_name_prefix="slack")
+
+# gspreadクライアントと監視対象リストのキャッシュ (ウォームインスタンス間で再利用)
+_GSPREAD_CLIENT: Optional[gspread.Client] = None
+_GSPREAD_LOCK = threading.Lock()
+_CODES_CACHE: Dict[str, Any] = {"ts": 0.0, "sheet_id": None, "codes": None}
+
+# 最後に送信した「開示なし」サマリーのキー ("YYYY-MM-DD:時間帯")。同一時間帯での重複送信を防ぐ
+_last_summary_key: Optional[str] = None
+_SUMMARY_LOCK = threading.Lock()
+
+def get_gspread_client() -> gspread.Client:
+    """
+    認証済みのgspreadクライアントを取得する。
+    初回のみ認証を行い、以降はプロセス内で同じクライアントを再利用する。
+    """
+    global _GSPREAD_CLIENT
+    with _GSPREAD_LOCK:
+        if _GSPREAD_CLIENT is None:
+            # Google Cloudの認証情報を自動取得 (Cloud RunのService Accountを使用)
+            scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+            # default() は環境に応じて適切な認証情報を探索します
+            creds, _ = google.auth.default(scopes=scopes)
+            _GSPREAD_CLIENT = gspread.authorize(creds)
+        return _GSPREAD_CLIENT
+
+def get_target_codes_from_sheet(sheet_id: str) -> FrozenSet[str]:
     """
     スプレッドシートから監視対象のEDINETコードリストを取得する。
     Args:
         sheet_id (str): Google Spreadsheet ID
     Returns:
-        List[str]: クリーニング済みのEDINETコードリスト
+        FrozenSet[str]: クリーニング済みのEDINETコード集合 (intern済み)
     """
     if not sheet_id:
         logger.error("Configuration Error: SPREADSHEET_ID is not set.")
-        return []
+        return frozenset()
+
+    # キャッシュが有効期間内であればシートを読みに行かない
+    if (
+        _CODES_CACHE["codes"] is not None
+        and _CODES_CACHE["sheet_id"] == sheet_id
+        and time.monotonic() - _CODES_CACHE["ts"] < CODES_CACHE_TTL
+    ):
+        return _CODES_CACHE["codes"]
 
     try:
-        # Google Cloudの認証情報を自動取得 (Cloud RunのService Accountを使用)
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        # default() は環境に応じて適切な認証情報を探索します
-        creds, _ = google.auth.default(scopes=scopes)
-        gc = gspread.authorize(creds)
+        gc = get_gspread_client()
 
         # シートを開く
         sh = gc.open_by_key(sheet_id)
@@ -75,26 +182,31 @@ def get_target_codes_from_sheet(sheet_id: str) -> List[str]:
         worksheet = sh.worksheet("対象リスト")
 
         # A列(1列目)の値を全て取得
-        codes = worksheet.col_values(1)
+        # 書式情報を含まない UNFORMATTED_VALUE で1回の values.get にまとめる
+        # (将来設定値などを同じシートから読む場合は sh.values_batch_get で1リクエストに集約する)
+        columns = worksheet.get('A:A', value_render_option='UNFORMATTED_VALUE', major_dimension='COLUMNS')
+        codes = columns[0] if columns else []
 
         # フィルタリング処理: 空白除去し、'E'から始まる正規のEDINETコードのみ抽出
-        clean_codes = [
-            str(c).strip() for c in codes 
+        # 照合を高速にするため、intern した文字列の frozenset として保持する
+        clean_codes = frozenset(
+            sys.intern(str(c).strip()) for c in codes 
             if c and str(c).strip().startswith('E')
-        ]
+        )
         
-        logger.info(f"Successfully loaded {len(clean_codes)} codes from sheet.")
+        logger.info("Successfully loaded %d codes from sheet.", len(clean_codes))
+        _CODES_CACHE.update(ts=time.monotonic(), sheet_id=sheet_id, codes=clean_codes)
         return clean_codes
 
     except gspread.exceptions.SpreadsheetNotFound:
         logger.error(f"Spreadsheet not found. ID: {sheet_id}")
-        return []
+        return frozenset()
     except gspread.exceptions.WorksheetNotFound:
         logger.error("Worksheet '対象リスト' not found.")
-        return []
+        return frozenset()
     except Exception as e:
         logger.exception(f"Unexpected error loading sheet: {e}")
-        return []
+        return frozenset()
 
 def fetch_edinet_documents(date_str: str, api_key: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
     """
@@ -113,14 +225,17 @@ def fetch_edinet_documents(date_str: str, api_key: Optional[str] = None) -> Opti
         params["Subscription-Key"] = api_key
 
     try:
-        session = get_session_with_retries()
-        res = session.get(EDINET_DOC_LIST_URL, params=params, timeout=REQUEST_TIMEOUT)
+        # Accept-Encoding は requests の既定値 (gzip, deflate 等) に任せる
+        res = SESSION.get(EDINET_DOC_LIST_URL, params=params, timeout=REQUEST_TIMEOUT)
         
         if res.status_code != 200:
             logger.error(f"EDINET API Error: {res.status_code} - {res.text}")
             return None
 
-        data = res.json()
+        logger.debug("EDINET response Content-Encoding: %s", res.headers.get('Content-Encoding'))
+
+        # 数MBになるJSONのため、標準jsonより高速なorjsonでデコードする
+        data = orjson.loads(res.content)
         results = data.get("results")
         
         return results if results is not None else []
@@ -128,10 +243,28 @@ def fetch_edinet_documents(date_str: str, api_key: Optional[str] = None) -> Opti
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error connecting to EDINET API: {e}")
         return None
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Failed to parse EDINET API response: {e}")
         return None
 
+def notify_summary_once(webhook_url: str, key: str, message: Dict[str, str]) -> bool:
+    """
+    「開示なし」のサマリーをSlackに通知する。
+    同じキー (日付と時間帯) のサマリーが送信済みの場合は送信しない。
+    インスタンス内のメモリで管理するため、複数インスタンス間での重複は防げない。
+    Returns:
+        bool: 今回送信した場合はTrue
+    """
+    global _last_summary_key
+    with _SUMMARY_LOCK:
+        if _last_summary_key == key:
+            logger.info("Summary already sent for %s. Skipping.", key)
+            return False
+        if not notify_slack(webhook_url, message):
+            return False
+        _last_summary_key = key
+        return True
+
 def notify_slack(webhook_url: str, message: Dict[str, str]) -> bool:
     """
     Slackに通知を送信する。
@@ -141,10 +274,9 @@ def notify_slack(webhook_url: str, message: Dict[str, str]) -> bool:
         return False
 
     try:
-        session = get_session_with_retries()
-        res = session.post(
+        res = SESSION.post(
             webhook_url, 
-            json=message, 
+            data=orjson.dumps(message),
             headers={'Content-Type': 'application/json'},
             timeout=REQUEST_TIMEOUT
         )
@@ -180,92 +312,87 @@ def check_edinet_and_notify() -> Tuple[str, int]:
             logger.critical(msg)
             return msg, 500
 
-        # 2. 監視対象リストの取得
-        target_edinet_codes = get_target_codes_from_sheet(sheet_id)
-        if not target_edinet_codes:
-            msg = "No target codes found in Spreadsheet. Aborting."
-            logger.warning(msg)
-            # 正常にシートは読めたが中身がない場合は200で終了する運用もアリだが、ここでは異常として警告
-            return msg, 500
-        
-        target_codes_set = set(target_edinet_codes)
-
-        # 3. 現在時刻と判定ロジックの設定
+        # 2. 現在時刻と判定ロジックの設定
         now = datetime.datetime.now(JST)
         today_str = now.strftime('%Y-%m-%d')
         
         # 閾値設定: 15:45 (東証の大引け後、主要な開示が出揃うタイミング)
-        threshold_time = now.replace(hour=15, minute=45, second=0, microsecond=0)
+        # APIの submitDateTime は 'YYYY-MM-DD HH:MM' 形式で辞書順=時刻順のため、文字列のまま比較する
+        threshold_str = f"{today_str} 15:45"
         is_night_run = now.hour >= 16
 
-        logger.info(f"Start Check - Date: {today_str}, NightRun: {is_night_run}, Targets: {len(target_codes_set)}")
+        # 3. 監視対象リストとEDINET書類一覧は互いに独立したI/Oのため、並行して取得する
+        f_codes = FETCH_EXECUTOR.submit(get_target_codes_from_sheet, sheet_id)
+        f_docs = FETCH_EXECUTOR.submit(fetch_edinet_documents, today_str, edinet_api_key)
+        target_codes_set = f_codes.result()
+        results = f_docs.result()
 
-        # 4. EDINET APIからデータ取得
-        results = fetch_edinet_documents(today_str, api_key=edinet_api_key)
-        
+        if not target_codes_set:
+            msg = "No target codes found in Spreadsheet. Aborting."
+            logger.warning(msg)
+            # 正常にシートは読めたが中身がない場合は200で終了する運用もアリだが、ここでは異常として警告
+            return msg, 500
+
+        logger.info("Start Check - Date: %s, NightRun: %s, Targets: %d", today_str, is_night_run, len(target_codes_set))
+
+        # 4. EDINET APIの取得結果を検証
         if results is None:
             return "Failed to fetch documents from EDINET API.", 500
         
-        notification_count = 0
+        # 通知待ちのメッセージ: (message, filer_name, doc_title)
+        pending: List[Tuple[Dict[str, str], str, str]] = []
 
         # 5. フィルタリングと通知
-        for doc in results:
-            edinet_code = doc.get("edinetCode")
-            
-            # 対象リストに含まれるかチェック
-            if edinet_code in target_codes_set:
-                
+        # 対象リストに含まれる書類だけを安価に抽出し、以降の処理はヒット分のみ行う
+        matches = [d for d in results if d.get("edinetCode") in target_codes_set]
+
+        # 夜間チェックでは15:45以前の書類は日中チェックで通知済みのため、まとめて除外する (重複防止用)
+        if is_night_run:
+            matches = [d for d in matches if (d.get("submitDateTime") or "") > threshold_str]
+
+        for doc in matches:
+            try:
+                submit_str, doc_title, filer_name, doc_id = _EXTRACT(doc)
+            except KeyError:
+                # 項目が欠けている書類のみ、既定値付きで個別に取得する
                 submit_str = doc.get("submitDateTime")
-                if not submit_str: 
-                    continue
-                
-                # 文字列をJSTの日時オブジェクトに変換
-                try:
-                    submit_dt = datetime.datetime.strptime(submit_str, '%Y-%m-%d %H:%M')
-                    submit_dt = submit_dt.replace(tzinfo=JST)
-                except ValueError:
-                    logger.warning(f"Invalid date format from API: {submit_str}")
-                    continue
-
-                # 通知判定ロジック (重複防止用)
-                should_notify = True
-                if is_night_run and submit_dt <= threshold_time:
-                    should_notify = False
-                
-                if should_notify:
-                    doc_title = doc.get("docDescription", "不明な書類")
-                    filer_name = doc.get("filerName", "不明な企業")
-                    doc_id = doc.get("docID", "")
-                    
-                    # リンク生成
-                    download_link = f"{EDINET_API_BASE_URL}/documents/{doc_id}?type=2"
-                    
-                    # Slackメッセージの構築
-                    message = {
-                        "text": (
-                            f"📢 *開示情報 ({submit_str})*\n"
-                            f"*企業名*: {filer_name}\n"
-                            f"*書類*: {doc_title}\n"
-                            f"*PDF*: {download_link}"
-                        )
-                    }
-                    if notify_slack(webhook_url, message):
-                        notification_count += 1
-                        logger.info(f"Notified: {filer_name} - {doc_title}")
-        
+                doc_title = doc.get("docDescription", UNKNOWN_DOC)
+                filer_name = doc.get("filerName", UNKNOWN_FILER)
+                doc_id = doc.get("docID", "")
+
+            if not submit_str: 
+                continue
+            
+            # 書式の簡易チェック ('YYYY-MM-DD HH:MM')
+            if len(submit_str) != 16 or submit_str[4] != '-':
+                logger.warning("Invalid date format from API: %s", submit_str)
+                continue
+
+            # リンク生成
+            download_link = f"{EDINET_API_BASE_URL}/documents/{doc_id}?type=2"
+            
+            # Slackメッセージの構築
+            message = {"text": SLACK_TEMPLATE.format(submit_str, filer_name, doc_title, download_link)}
+            pending.append((message, filer_name, doc_title))
+
+        # 各通知は独立したI/Oのため、並列に送信する
+        notification_count = 0
+        if pending:
+            sent = list(SLACK_EXECUTOR.map(lambda p: notify_slack(webhook_url, p[0]), pending))
+            for ok, (_, filer_name, doc_title) in zip(sent, pending):
+                if ok:
+                    logger.info("Notified: %s - %s", filer_name, doc_title)
+            notification_count = sum(sent)
+
         # 6. 通知なしのハンドリング
         if notification_count == 0:
             time_label = "夜間チェック" if is_night_run else "日中チェック"
-            logger.info(f"No new disclosures found for target companies ({time_label}).")
+            logger.info("No new disclosures found for target companies (%s).", time_label)
             
             # 通知ゼロのメッセージ
-            no_data_message = {
-                "text": (
-                    f"✅ *開示なし ({today_str} {time_label})*\n"
-                    f"監視対象({len(target_codes_set)}社)について、新規の開示はありませんでした。"
-                )
-            }
-            notify_slack(webhook_url, no_data_message)
+            if SUMMARY_ENABLED:
+                no_data_message = {"text": SUMMARY_TEMPLATE.format(today_str, time_label, len(target_codes_set))}
+                notify_summary_once(webhook_url, f"{today_str}:{time_label}", no_data_message)
 
         result_msg = f"Success. Checked {len(results)} docs. Sent {notification_count} notifications."
         logger.info(result_msg)
@@ -276,6 +403,7 @@ def check_edinet_and_notify() -> Tuple[str, int]:
         return f"Internal Error: {str(e)}", 500
 
 # ▼▼▼ 変更点4: 起動スクリプトを追加 ▼▼▼
+# ローカル開発用。本番 (Cloud Run) では Dockerfile の gunicorn から起動する
 if __name__ == "__main__":
     # Cloud Run は環境変数 PORT (デフォルト8080) を指定してくるため、それに従う
     port = int(os.environ.get("PORT", 8080))